@@ -5,72 +5,242 @@ Combines your existing eye tracking with HTTP health checks
 """
 
 import asyncio
-import json
+import functools
 import os
+import pathlib
+import sys
+import time
+import zlib
+from collections import deque
 from datetime import datetime
 import logging
 from aiohttp import web, WSMsgType
 from aiohttp.web import Response, WebSocketResponse
 import cv2
 import numpy as np
+import orjson
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Configure logging (per-client events are only logged at DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
+# Keep OpenCV from spinning up a worker pool that competes with the event loop thread
+cv2.setNumThreads(1)
+
 # Get host and port from environment variables
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('PORT', 10000))
+# Optional cap on concurrent WebSocket clients; unset or 0 means unlimited
+MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', 0))
+
+# Face cascade file name (looked up in OpenCV's data directory) or absolute path,
+# e.g. a faster LBP cascade such as lbpcascade_frontalface_improved.xml
+FACE_CASCADE = os.getenv('FACE_CASCADE', 'haarcascade_frontalface_default.xml')
+
+# Cascade files resolved once at import
+CASCADE_DIR = pathlib.Path(cv2.__path__[0]) / 'data'
+FACE_CASCADE_PATH = CASCADE_DIR / FACE_CASCADE
+EYE_CASCADE_PATH = CASCADE_DIR / 'haarcascade_eye.xml'
+
+# Outgoing messages buffered per client before the oldest ones are dropped
+CLIENT_QUEUE_SIZE = 64
+
+# Seconds between simulated eye tracking updates
+EYE_DATA_INTERVAL = 0.5
+
+# Maximum number of queued messages coalesced into a single WebSocket frame
+MAX_BATCH_SIZE = 16
+
+# Largest batch_size a client may request in start_tracking
+MAX_SAMPLE_BATCH_SIZE = 50
+
+# Seconds between aggregated connection statistics log lines
+STATS_INTERVAL = 1.0
+
+# Incoming messages larger than this many characters are parsed on a worker thread
+LARGE_MESSAGE_SIZE = 16384
+
+# zlib level for clients that opt into compressed frames; cheap since payloads are tiny
+ZLIB_LEVEL = 1
+
+def encode_json(obj):
+    """Serialize an object to UTF-8 JSON bytes"""
+    return orjson.dumps(obj)
+
+# Last generated timestamp as [time.time(), str, bytes], reused for 1ms so that every
+# message sent within the same tick shares a single datetime formatting
+TIMESTAMP_CACHE = [0.0, "", b""]
+
+def cached_timestamp():
+    """Refresh the timestamp cache if it is older than 1ms and return it"""
+    now = time.time()
+    if not 0.0 <= now - TIMESTAMP_CACHE[0] < 0.001:
+        timestamp = datetime.fromtimestamp(now).isoformat()
+        TIMESTAMP_CACHE[:] = [now, timestamp, timestamp.encode()]
+    return TIMESTAMP_CACHE
+
+def now_iso():
+    """Current local time as UTF-8 ISO 8601 bytes, for splicing into pre-encoded JSON"""
+    return cached_timestamp()[2]
+
+def now_iso_str():
+    """Current local time as an ISO 8601 string, for building JSON objects"""
+    return cached_timestamp()[1]
+
+# Simulated eye data only varies in timestamp, looking_away and confidence,
+# so the rest of the message is pre-encoded and the varying fields are spliced in
+SIMULATED_EYE_DATA_TEMPLATE = (
+    b'{"type":"eye_data","timestamp":"%s","face_detected":true,"eye_count":2,'
+    b'"looking_away":%s,"confidence":%s,'
+    b'"note":"Simulated data - camera not available in cloud environment"}'
+)
+SIMULATED_CONFIDENCES = [encode_json(0.8 + step * 0.04) for step in range(5)]
+
+PONG_TEMPLATE = b'{"type":"pong","timestamp":"%s"}'
+
+# Seconds between protocol-level WebSocket pings sent by the server
+HEARTBEAT_INTERVAL = 20.0
+
+@functools.lru_cache(maxsize=1)
+def load_cascades():
+    """Load the face and eye cascade classifiers once per process, returning None for any that are missing"""
+    try:
+        # A missing or unreadable file yields an empty classifier, so empty() covers both cases
+        face_cascade = cv2.CascadeClassifier(str(FACE_CASCADE_PATH))
+        if face_cascade.empty():
+            logger.warning(f"Face cascade could not be loaded from {FACE_CASCADE_PATH}")
+            face_cascade = None
+            
+        eye_cascade = cv2.CascadeClassifier(str(EYE_CASCADE_PATH))
+        if eye_cascade.empty():
+            logger.warning(f"Eye cascade could not be loaded from {EYE_CASCADE_PATH}")
+            eye_cascade = None
+            
+        if face_cascade and eye_cascade:
+            logger.info("✅ Cascade classifiers loaded successfully")
+        else:
+            logger.warning("⚠️ Some cascade classifiers failed to load - using simulation mode")
+            
+        return face_cascade, eye_cascade
+        
+    except Exception as e:
+        logger.warning(f"⚠️ Error loading cascade classifiers: {e} - using simulation mode")
+        return None, None
+
+class ClientQueue:
+    """Outgoing messages for one client: a bounded deque plus a future that wakes its writer task"""
+
+    def __init__(self):
+        # A full deque silently drops its oldest message
+        self.messages = deque(maxlen=CLIENT_QUEUE_SIZE)
+        self.waiter = None
+
+        # Eye data samples held back until the client's requested batch is full
+        self.batch_size = 1
+        self.pending_samples = []
+
+    def put(self, message):
+        """Append a message and wake the writer if it is waiting"""
+        self.messages.append(message)
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def wait(self):
+        """Wait until at least one message is queued"""
+        while not self.messages:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
 
 class EyeTracker:
     def __init__(self):
-        self.connected_clients = set()
-        self.is_running = False
+        # O(1) count of connected clients, checked against MAX_CONNECTIONS
+        self.client_count = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.stats_task = None
+        self.client_queues = {}
+        self.tracking_clients = set()
+        self.zlib_clients = set()
+        self.tracking_task = None
+        self.latest_payload = b""
+        self.latest_compressed = b""
         
-        try:
-            # Load cascade classifiers
-            face_cascade_path = cv2.__path__[0] + '/data/haarcascade_frontalface_default.xml'
-            eye_cascade_path = cv2.__path__[0] + '/data/haarcascade_eye.xml'
-            
-            if not os.path.exists(face_cascade_path):
-                logger.warning(f"Face cascade file not found: {face_cascade_path}")
-                self.face_cascade = None
-            else:
-                self.face_cascade = cv2.CascadeClassifier(face_cascade_path)
-                
-            if not os.path.exists(eye_cascade_path):
-                logger.warning(f"Eye cascade file not found: {eye_cascade_path}")
-                self.eye_cascade = None
-            else:
-                self.eye_cascade = cv2.CascadeClassifier(eye_cascade_path)
-                
-            if self.face_cascade and not self.face_cascade.empty() and self.eye_cascade and not self.eye_cascade.empty():
-                logger.info("✅ Cascade classifiers loaded successfully")
-            else:
-                logger.warning("⚠️ Some cascade classifiers failed to load - using simulation mode")
-                
-        except Exception as e:
-            logger.warning(f"⚠️ Error loading cascade classifiers: {e} - using simulation mode")
-            self.face_cascade = None
-            self.eye_cascade = None
+        self.face_cascade, self.eye_cascade = load_cascades()
+
+    async def log_connection_stats(self):
+        """Log connection churn once per interval instead of once per client"""
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            if self.connects or self.disconnects:
+                logger.info(
+                    "📊 Clients: %d (+%d connected, -%d disconnected)",
+                    self.client_count, self.connects, self.disconnects
+                )
+                self.connects = 0
+                self.disconnects = 0
+
+    async def start_background_tasks(self, app):
+        """Start tasks that live as long as the application"""
+        self.stats_task = asyncio.create_task(self.log_connection_stats())
+
+    async def stop_background_tasks(self, app):
+        """Stop the tasks started by start_background_tasks"""
+        if self.stats_task is not None:
+            self.stats_task.cancel()
 
     async def handle_websocket(self, request):
         """Handle WebSocket connections"""
-        ws = WebSocketResponse()
-        await ws.prepare(request)
-
-        self.connected_clients.add(ws)
         client_ip = request.remote if request.remote else "unknown"
-        logger.info(f"✅ Client connected from {client_ip}. Total clients: {len(self.connected_clients)}")
 
+        # Turn clients away before the upgrade once the server is full
+        if MAX_CONNECTIONS and self.client_count >= MAX_CONNECTIONS:
+            logger.warning(f"⚠️ Rejecting client from {client_ip}: connection limit of {MAX_CONNECTIONS} reached")
+            return Response(status=503, text="Too many connections")
+
+        # permessage-deflate would keep a zlib context per client; clients that want
+        # compression opt into zlib frames compressed once per tick instead
+        ws = WebSocketResponse(heartbeat=HEARTBEAT_INTERVAL, compress=False)
+        writer_task = None
+
+        # Reserve the slot before the handshake so concurrent upgrades can't overshoot the limit;
+        # a failed handshake (e.g. no Upgrade header) releases it and lets aiohttp answer the error
+        self.client_count += 1
         try:
+            await ws.prepare(request)
+        except Exception:
+            self.client_count -= 1
+            raise
+
+        # Every bit of per-client state is registered and released under this one try/finally
+        try:
+            # Every client gets its own bounded queue drained by a dedicated writer task,
+            # so a slow socket never holds up the producer or the other clients
+            queue = ClientQueue()
+            self.client_queues[ws] = queue
+            writer_task = asyncio.create_task(self.send_queued_messages(ws, queue))
+
+            self.connects += 1
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"✅ Client connected from {client_ip}. Total clients: {self.client_count}")
+
             # Send welcome message
-            await ws.send_str(json.dumps({
+            self.send_message(ws, encode_json({
                 "type": "connection",
                 "message": "Eye tracking connected",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now_iso_str(),
                 "server_info": {
-                    "version": "1.0.0"
+                    "version": "1.0.0",
+                    "batched": True,
+                    "compression": ["zlib"]
                 }
             }))
 
@@ -78,9 +248,13 @@ class EyeTracker:
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     try:
-                        data = json.loads(msg.data)
+                        # Parsing a large frame inline would stall every other client
+                        if len(msg.data) > LARGE_MESSAGE_SIZE:
+                            data = await asyncio.get_running_loop().run_in_executor(None, orjson.loads, msg.data)
+                        else:
+                            data = orjson.loads(msg.data)
                         await self.process_message(ws, data)
-                    except json.JSONDecodeError:
+                    except orjson.JSONDecodeError:
                         logger.warning(f"❌ Invalid JSON received from {client_ip}")
                 elif msg.type == WSMsgType.ERROR:
                     logger.error(f"❌ WebSocket error: {ws.exception()}")
@@ -89,83 +263,185 @@ class EyeTracker:
         except Exception as e:
             logger.error(f"❌ WebSocket error: {e}")
         finally:
-            self.connected_clients.discard(ws)
-            logger.info(f"👋 Client disconnected. Total clients: {len(self.connected_clients)}")
+            self.client_count -= 1
+            self.tracking_clients.discard(ws)
+            self.zlib_clients.discard(ws)
+            self.client_queues.pop(ws, None)
+            if writer_task is not None:
+                writer_task.cancel()
+            self.disconnects += 1
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"👋 Client disconnected. Total clients: {self.client_count}")
 
         return ws
 
+    def send_message(self, ws, message):
+        """Queue an encoded JSON message for a client, dropping its oldest message if the client is falling behind"""
+        queue = self.client_queues.get(ws)
+        if queue is None:
+            return
+
+        queue.put(message)
+
+    async def send_queued_messages(self, ws, queue):
+        """Writer task that drains a client's queue onto its WebSocket"""
+        try:
+            while True:
+                await queue.wait()
+                messages = [queue.messages.popleft()]
+                while len(messages) < MAX_BATCH_SIZE and queue.messages:
+                    messages.append(queue.messages.popleft())
+
+                # Messages that piled up while the socket was busy go out as one JSON array frame
+                if len(messages) == 1:
+                    frame = messages[0]
+                else:
+                    # Splice already batched samples into the array rather than nesting them
+                    frame = b"[" + b",".join(m[1:-1] if m[:1] == b"[" else m for m in messages) + b"]"
+
+                if ws in self.zlib_clients:
+                    await ws.send_frame(self.compress_frame(frame), WSMsgType.BINARY)
+                else:
+                    # Messages are already UTF-8 JSON, so send them as text frames without re-encoding
+                    await ws.send_frame(frame, WSMsgType.TEXT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error sending data: {e}")
+
+    def send_sample(self, ws, payload):
+        """Queue an eye data sample for a client, grouping samples into batches if the client asked for them"""
+        queue = self.client_queues.get(ws)
+        if queue is None:
+            return
+
+        if queue.batch_size == 1:
+            queue.put(payload)
+            return
+
+        queue.pending_samples.append(payload)
+        if len(queue.pending_samples) >= queue.batch_size:
+            queue.put(b"[" + b",".join(queue.pending_samples) + b"]")
+            queue.pending_samples = []
+
+    def compress_frame(self, frame):
+        """zlib-compress a frame, compressing each tick's shared payload only once"""
+        if frame is self.latest_payload:
+            if not self.latest_compressed:
+                self.latest_compressed = zlib.compress(frame, ZLIB_LEVEL)
+            return self.latest_compressed
+        return zlib.compress(frame, ZLIB_LEVEL)
+
     async def process_message(self, ws, data):
         """Process incoming WebSocket messages"""
         message_type = data.get('type')
         
         if message_type == 'start_tracking':
-            logger.info("🎯 Starting eye tracking...")
-            await self.start_eye_tracking(ws)
+            logger.debug("🎯 Starting eye tracking...")
+            # Compression follows the latest start_tracking, so clients can also opt back out
+            if data.get('compression') == 'zlib':
+                self.zlib_clients.add(ws)
+            else:
+                self.zlib_clients.discard(ws)
+            
+            batch_size = data.get('batch_size', 1)
+            if type(batch_size) is not int or not 1 <= batch_size <= MAX_SAMPLE_BATCH_SIZE:
+                logger.warning(f"❓ Ignoring invalid batch_size: {batch_size!r}")
+                batch_size = 1
+            self.start_eye_tracking(ws, batch_size)
         elif message_type == 'stop_tracking':
-            logger.info("⏹️ Stopping eye tracking...")
-            self.is_running = False
+            logger.debug("⏹️ Stopping eye tracking...")
+            self.tracking_clients.discard(ws)
+            queue = self.client_queues.get(ws)
+            if queue is not None:
+                queue.pending_samples = []
         elif message_type == 'ping':
-            await ws.send_str(json.dumps({
-                "type": "pong",
-                "timestamp": datetime.now().isoformat()
-            }))
+            # Keepalives are handled by protocol-level heartbeats; this JSON ping is kept
+            # for clients such as browsers that can't send ping frames themselves
+            self.send_message(ws, PONG_TEMPLATE % now_iso())
         else:
             logger.warning(f"❓ Unknown message type: {message_type}")
 
-    async def start_eye_tracking(self, ws):
-        """Start eye tracking simulation (since cameras aren't available in cloud)"""
-        self.is_running = True
-        
+    def start_eye_tracking(self, ws, batch_size=1):
+        """Subscribe a client to eye tracking, starting the shared producer if needed"""
+        queue = self.client_queues.get(ws)
+        if queue is not None:
+            # Deliver samples held for the old batch size rather than dropping them, so
+            # changing batch_size mid-stream neither repeats nor loses a sample
+            if queue.pending_samples:
+                queue.put(b"[" + b",".join(queue.pending_samples) + b"]")
+            queue.batch_size = batch_size
+            queue.pending_samples = []
+        already_tracking = ws in self.tracking_clients
+        self.tracking_clients.add(ws)
+
+        if self.tracking_task is None:
+            self.tracking_task = asyncio.create_task(self.produce_eye_data())
+        elif self.latest_payload and not already_tracking:
+            # Don't make late subscribers wait for the next tick; existing ones already have this sample
+            self.send_sample(ws, self.latest_payload)
+
+    async def produce_eye_data(self):
+        """Produce eye tracking simulation data once per tick and broadcast it to all tracking clients (since cameras aren't available in cloud)"""
         try:
             # Simulate eye tracking data since cameras aren't available in cloud environments
+            loop = asyncio.get_running_loop()
+            next_tick = loop.time()
             counter = 0
-            while self.is_running:
+            while self.tracking_clients:
                 counter += 1
                 
-                # Simulate realistic eye tracking data
-                eye_data = {
-                    "type": "eye_data",
-                    "timestamp": datetime.now().isoformat(),
-                    "face_detected": True,
-                    "eye_count": 2,
-                    "looking_away": counter % 10 < 8,  # Looking away 20% of the time
-                    "confidence": 0.8 + (counter % 5) * 0.04,  # Varying confidence
-                    "note": "Simulated data - camera not available in cloud environment"
-                }
-                
-                try:
-                    await ws.send_str(json.dumps(eye_data))
-                except Exception as e:
-                    logger.error(f"❌ Error sending data: {e}")
-                    break
+                # Simulate realistic eye tracking data, serialized once and shared with every client
+                payload = SIMULATED_EYE_DATA_TEMPLATE % (
+                    now_iso(),
+                    b"true" if counter % 10 < 8 else b"false",  # Looking away 20% of the time
+                    SIMULATED_CONFIDENCES[counter % 5]  # Varying confidence
+                )
+                self.latest_payload = payload
+                self.latest_compressed = b""
+                for ws in self.tracking_clients:
+                    self.send_sample(ws, payload)
                 
-                await asyncio.sleep(0.5)  # Send updates every 500ms
+                # Send updates every 500ms against absolute deadlines so ticks don't drift;
+                # if the loop stalled past a deadline, skip ahead instead of bursting
+                next_tick += EYE_DATA_INTERVAL
+                now = loop.time()
+                if next_tick < now:
+                    next_tick = now
+                await asyncio.sleep(next_tick - now)
                 
         except Exception as e:
             logger.error(f"❌ Eye tracking error: {e}")
+        finally:
+            self.tracking_task = None
+            self.latest_payload = b""
+            self.latest_compressed = b""
+
+# Only the timestamp in the health response changes, so the rest is pre-encoded
+HEALTH_PREFIX = b'{"status":"healthy","timestamp":"'
+HEALTH_SUFFIX = b'","service":"eye-tracking-backend","version":"1.0.0","port":%d}' % PORT
 
 async def health_check(request):
     """Health check endpoint for Render"""
-    return Response(text=json.dumps({
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "service": "eye-tracking-backend",
-        "version": "1.0.0",
-        "port": PORT
-    }), content_type='application/json')
+    return Response(body=HEALTH_PREFIX + now_iso() + HEALTH_SUFFIX, content_type='application/json')
 
-async def websocket_info(request):
-    """WebSocket connection info endpoint"""
-    return Response(text=json.dumps({
-        "websocket_url": f"ws://{request.host}/ws",
-        "websocket_url_secure": f"wss://{request.host}/ws",
+@functools.lru_cache(maxsize=32)
+def websocket_info_body(host):
+    """Encoded WebSocket info for a host; bounded since the Host header is client supplied"""
+    return encode_json({
+        "websocket_url": f"ws://{host}/ws",
+        "websocket_url_secure": f"wss://{host}/ws",
         "instructions": "Connect to /ws endpoint for WebSocket communication",
         "supported_messages": [
             {"type": "ping", "description": "Health check ping"},
             {"type": "start_tracking", "description": "Start eye tracking"},
             {"type": "stop_tracking", "description": "Stop eye tracking"}
         ]
-    }), content_type='application/json')
+    })
+
+async def websocket_info(request):
+    """WebSocket connection info endpoint"""
+    return Response(body=websocket_info_body(request.host), content_type='application/json')
 
 async def create_app():
     """Create the web application"""
@@ -181,6 +457,10 @@ async def create_app():
     # WebSocket route
     app.router.add_get('/ws', tracker.handle_websocket)
     
+    # Background tasks
+    app.on_startup.append(tracker.start_background_tasks)
+    app.on_cleanup.append(tracker.stop_background_tasks)
+    
     return app
 
 async def main():
@@ -211,6 +491,10 @@ async def main():
         raise
 
 if __name__ == "__main__":
+    # uvloop is a faster drop-in event loop; fall back to stock asyncio without it
+    if uvloop is not None and sys.platform != "win32":
+        uvloop.install()
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
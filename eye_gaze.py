@@ -1,56 +1,242 @@
 import cv2
 import numpy as np
-import json
+import orjson
 import asyncio
+import functools
 import os
+import pathlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 from websockets.server import serve
 from websockets.exceptions import ConnectionClosed
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keep OpenCV from spinning up a worker pool that competes with the event loop and capture threads
+cv2.setNumThreads(1)
+
 # Get host and port from environment variables (for cloud hosting)
 HOST = os.getenv('HOST', 'localhost')
 PORT = int(os.getenv('PORT', 5000))
 
-class EyeTracker:
-    def __init__(self):
-        try:
-            # Load cascade classifiers with error handling
-            face_cascade_path = cv2.__path__[0] + '/data/haarcascade_frontalface_default.xml'
-            eye_cascade_path = cv2.__path__[0] + '/data/haarcascade_eye.xml'
-            
-            if not os.path.exists(face_cascade_path):
-                logger.error(f"❌ Face cascade file not found: {face_cascade_path}")
-                raise FileNotFoundError(f"Face cascade file not found: {face_cascade_path}")
-                
-            if not os.path.exists(eye_cascade_path):
-                logger.error(f"❌ Eye cascade file not found: {eye_cascade_path}")
-                raise FileNotFoundError(f"Eye cascade file not found: {eye_cascade_path}")
+def json_text(obj):
+    """Serialize an object with orjson into a str, so websockets sends it as a text frame
+
+    datetime values are written exactly as datetime.isoformat() would write them.
+    """
+    return orjson.dumps(obj).decode()
+
+# Face cascade file name (looked up in OpenCV's data directory) or absolute path,
+# e.g. a faster LBP cascade such as lbpcascade_frontalface_improved.xml
+FACE_CASCADE = os.getenv('FACE_CASCADE', 'haarcascade_frontalface_default.xml')
+
+# Cascade files resolved once at import
+CASCADE_DIR = pathlib.Path(cv2.__path__[0]) / 'data'
+FACE_CASCADE_PATH = CASCADE_DIR / FACE_CASCADE
+EYE_CASCADE_PATH = CASCADE_DIR / 'haarcascade_eye.xml'
+
+# Camera capture settings: MJPEG at a modest resolution keeps per-frame copies small
+CAPTURE_WIDTH = 640
+CAPTURE_HEIGHT = 480
+CAPTURE_FPS = 15
+
+# Faces are searched for on a downscaled frame; minSize already rules out tiny faces
+FACE_DETECTION_SCALE = 0.5
+
+# While a face is being tracked, the face cascade is only re-run every N frames
+FACE_REDETECT_INTERVAL = 10
+
+# MOSSE tracking needs the opencv-contrib build; without it the cascade runs every frame
+FACE_TRACKER_AVAILABLE = hasattr(cv2, 'legacy') and hasattr(cv2.legacy, 'TrackerMOSSE_create')
+
+@functools.lru_cache(maxsize=1)
+def load_cascades():
+    """Load the face and eye cascade classifiers once per process"""
+    try:
+        # A missing or unreadable file yields an empty classifier, so empty() covers both cases
+        face_cascade = cv2.CascadeClassifier(str(FACE_CASCADE_PATH))
+        if face_cascade.empty():
+            logger.error(f"❌ Failed to load face cascade classifier from {FACE_CASCADE_PATH}")
+            raise RuntimeError(f"Failed to load face cascade classifier from {FACE_CASCADE_PATH}")
             
-            self.face_cascade = cv2.CascadeClassifier(face_cascade_path)
-            self.eye_cascade = cv2.CascadeClassifier(eye_cascade_path)
+        eye_cascade = cv2.CascadeClassifier(str(EYE_CASCADE_PATH))
+        if eye_cascade.empty():
+            logger.error(f"❌ Failed to load eye cascade classifier from {EYE_CASCADE_PATH}")
+            raise RuntimeError(f"Failed to load eye cascade classifier from {EYE_CASCADE_PATH}")
             
-            # Check if cascade classifiers loaded successfully
-            if self.face_cascade.empty():
-                logger.error("❌ Failed to load face cascade classifier")
-                raise RuntimeError("Failed to load face cascade classifier")
-                
-            if self.eye_cascade.empty():
-                logger.error("❌ Failed to load eye cascade classifier")
-                raise RuntimeError("Failed to load eye cascade classifier")
+        logger.info("✅ Cascade classifiers loaded successfully")
+        return face_cascade, eye_cascade
+        
+    except Exception as e:
+        logger.error(f"❌ Error initializing cascade classifiers: {e}")
+        raise
+
+class EyeTracker:
+    def __init__(self):
+        self.face_cascade, self.eye_cascade = load_cascades()
+        
+        self.connected_clients = set()
+        self.is_running = False
+        
+        # Single worker thread for camera reads and detection, so OpenCV calls never overlap
+        self.capture_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture")
+        
+        # Run cascade detection through OpenCV's transparent API (OpenCL) when a device is available
+        self.use_opencl = cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.use_opencl)
+        if self.use_opencl:
+            logger.info("⚡ OpenCL available - running cascade detection on the GPU")
+        
+        # Grayscale working buffers reused across frames, keyed by name: (size, buffer)
+        self.buffers = {}
+        
+        # Tracker following the last detected face between cascade runs
+        self.face_tracker = None
+        self.frames_since_detection = 0
+        if not FACE_TRACKER_AVAILABLE:
+            logger.info("ℹ️ MOSSE tracker not available - running face detection on every frame")
+        
+    def get_buffer(self, name, height, width):
+        """Return a grayscale buffer that is only reallocated when the requested size changes"""
+        size, buffer = self.buffers.get(name, (None, None))
+        if size != (height, width):
+            if self.use_opencl:
+                buffer = cv2.UMat(height, width, cv2.CV_8UC1)
+            else:
+                buffer = np.empty((height, width), dtype=np.uint8)
+            self.buffers[name] = ((height, width), buffer)
+        return buffer
+        
+    def to_gray(self, frame):
+        """Convert a frame to grayscale into a reused buffer (a UMat when OpenCL is enabled)"""
+        frame_height, frame_width = frame.shape[:2]
+        gray = self.get_buffer('gray', frame_height, frame_width)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        
+    def crop(self, image, x, y, w, h):
+        """Crop a region from either a numpy array or a UMat"""
+        if isinstance(image, cv2.UMat):
+            return cv2.UMat(image, (int(y), int(y + h)), (int(x), int(x + w)))
+        return image[y:y+h, x:x+w]
+        
+    def clip_box(self, box, frame):
+        """Clip an (x, y, w, h) box to the frame, returning None if nothing is left"""
+        frame_height, frame_width = frame.shape[:2]
+        x, y, w, h = (int(v) for v in box)
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(frame_width, x + w), min(frame_height, y + h)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return (x1, y1, x2 - x1, y2 - y1)
+        
+    def detect_faces(self, frame, gray):
+        """Detect faces, following a detected face with a tracker between cascade runs"""
+        if self.face_tracker is not None and self.frames_since_detection < FACE_REDETECT_INTERVAL:
+            ok, bbox = self.face_tracker.update(frame)
+            if ok:
+                self.frames_since_detection += 1
                 
-            logger.info("✅ Cascade classifiers loaded successfully")
+                # Keep the tracked box inside the frame so it can be cropped safely
+                face = self.clip_box(bbox, frame)
+                if face is not None:
+                    return [face]
+        
+        # Detect faces on a downscaled frame with adjusted parameters for better detection
+        frame_height, frame_width = frame.shape[:2]
+        small_width = round(frame_width * FACE_DETECTION_SCALE)
+        small_height = round(frame_height * FACE_DETECTION_SCALE)
+        small = cv2.resize(
+            gray,
+            (small_width, small_height),
+            dst=self.get_buffer('small', small_height, small_width),
+            interpolation=cv2.INTER_AREA
+        )
+        min_face_size = int(30 * FACE_DETECTION_SCALE)
+        small_faces = self.face_cascade.detectMultiScale(
+            small, 
+            scaleFactor=1.1, 
+            minNeighbors=5, 
+            minSize=(min_face_size, min_face_size)
+        )
+        
+        # Scale the boxes back up so eyes are detected in the full resolution frame
+        faces = []
+        for small_face in small_faces:
+            face = self.clip_box([v / FACE_DETECTION_SCALE for v in small_face], frame)
+            if face is not None:
+                faces.append(face)
+        
+        self.face_tracker = None
+        if FACE_TRACKER_AVAILABLE and faces:
+            self.face_tracker = cv2.legacy.TrackerMOSSE_create()
+            self.face_tracker.init(frame, faces[0])
+            self.frames_since_detection = 0
+        
+        return faces
+        
+    def configure_camera(self, cap):
+        """Request compressed, lower resolution frames and avoid buffering stale ones"""
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+        cap.set(cv2.CAP_PROP_FPS, CAPTURE_FPS)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        
+    def grab_and_detect(self, cap):
+        """Read a frame and run face and eye detection on it (blocking, runs in the capture thread)"""
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        
+        # Convert to grayscale for detection
+        gray = self.to_gray(frame)
+        
+        faces = self.detect_faces(frame, gray)
+        
+        eye_data = {
+            "type": "eye_data",
+            "timestamp": datetime.now(),
+            "face_detected": len(faces) > 0,
+            "eye_count": 0,
+            "looking_away": False,
+            "confidence": 0.0
+        }
+        
+        for (x, y, w, h) in faces:
+            roi_gray = self.crop(gray, x, y, w, h)
+            roi_color = frame[y:y+h, x:x+w]
             
-        except Exception as e:
-            logger.error(f"❌ Error initializing cascade classifiers: {e}")
-            raise
+            # Detect eyes within the face region
+            eyes = self.eye_cascade.detectMultiScale(
+                roi_gray,
+                scaleFactor=1.1,
+                minNeighbors=5,
+                minSize=(20, 20)
+            )
+            eye_data["eye_count"] = len(eyes)
             
-        self.connected_clients = set()
-        self.is_running = False
+            # Calculate confidence based on face and eye detection
+            if len(faces) > 0 and len(eyes) >= 2:
+                eye_data["confidence"] = min(1.0, len(eyes) / 2.0)
+            elif len(faces) > 0:
+                eye_data["confidence"] = 0.5
+            else:
+                eye_data["confidence"] = 0.0
+        
+        # Determine if user is looking away
+        if len(faces) == 0 or eye_data["eye_count"] < 2:
+            eye_data["looking_away"] = True
+        
+        return eye_data
         
     async def start_server(self):
         """Start the WebSocket server"""
@@ -78,18 +264,18 @@ class EyeTracker:
             logger.info(f"✅ Client connected. Total clients: {len(self.connected_clients)}")
             
             # Send welcome message
-            await websocket.send(json.dumps({
+            await websocket.send(json_text({
                 "type": "connection",
                 "message": "Eye tracking connected",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }))
             
             # Keep connection alive and handle messages
             async for message in websocket:
                 try:
-                    data = json.loads(message)
+                    data = orjson.loads(message)
                     await self.process_message(websocket, data)
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     logger.warning("❌ Invalid JSON received")
                 except Exception as e:
                     logger.error(f"❌ Error processing message: {e}")
@@ -113,9 +299,9 @@ class EyeTracker:
             logger.info("⏹️ Stopping eye tracking...")
             self.is_running = False
         elif message_type == 'ping':
-            await websocket.send(json.dumps({
+            await websocket.send(json_text({
                 "type": "pong",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }))
         else:
             logger.warning(f"❓ Unknown message type: {message_type}")
@@ -144,70 +330,30 @@ class EyeTracker:
         
         if not cap or not cap.isOpened():
             logger.error("❌ Could not open camera on any index")
-            await websocket.send(json.dumps({
+            await websocket.send(json_text({
                 "type": "error",
                 "message": "Could not open camera - no camera available",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }))
             return
 
         logger.info("📹 Camera initialized successfully")
+        self.configure_camera(cap)
+        self.face_tracker = None
+        
+        loop = asyncio.get_running_loop()
         
         try:
             while self.is_running:
-                ret, frame = cap.read()
-                if not ret:
+                # Capture and detection block for tens of milliseconds, so keep them off the event loop
+                eye_data = await loop.run_in_executor(self.capture_executor, self.grab_and_detect, cap)
+                if eye_data is None:
                     logger.warning("❌ Failed to read frame")
                     continue
-
-                # Convert to grayscale for detection
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                
-                # Detect faces with adjusted parameters for better detection
-                faces = self.face_cascade.detectMultiScale(
-                    gray, 
-                    scaleFactor=1.1, 
-                    minNeighbors=5, 
-                    minSize=(30, 30)
-                )
-                
-                eye_data = {
-                    "type": "eye_data",
-                    "timestamp": datetime.now().isoformat(),
-                    "face_detected": len(faces) > 0,
-                    "eye_count": 0,
-                    "looking_away": False,
-                    "confidence": 0.0
-                }
-                
-                for (x, y, w, h) in faces:
-                    roi_gray = gray[y:y+h, x:x+w]
-                    roi_color = frame[y:y+h, x:x+w]
-                    
-                    # Detect eyes within the face region
-                    eyes = self.eye_cascade.detectMultiScale(
-                        roi_gray,
-                        scaleFactor=1.1,
-                        minNeighbors=5,
-                        minSize=(20, 20)
-                    )
-                    eye_data["eye_count"] = len(eyes)
-                    
-                    # Calculate confidence based on face and eye detection
-                    if len(faces) > 0 and len(eyes) >= 2:
-                        eye_data["confidence"] = min(1.0, len(eyes) / 2.0)
-                    elif len(faces) > 0:
-                        eye_data["confidence"] = 0.5
-                    else:
-                        eye_data["confidence"] = 0.0
-                
-                # Determine if user is looking away
-                if len(faces) == 0 or eye_data["eye_count"] < 2:
-                    eye_data["looking_away"] = True
                 
                 # Send data to client
                 try:
-                    await websocket.send(json.dumps(eye_data))
+                    await websocket.send(json_text(eye_data))
                 except ConnectionClosed:
                     logger.info("🔌 Client disconnected during tracking")
                     break
@@ -222,7 +368,8 @@ class EyeTracker:
             logger.error(f"❌ Eye tracking error: {e}")
         finally:
             if cap:
-                cap.release()
+                # Release on the capture thread so it can't race an in-flight read
+                await loop.run_in_executor(self.capture_executor, cap.release)
             logger.info("📹 Camera released")
 
 async def main():
@@ -231,6 +378,10 @@ async def main():
     await tracker.start_server()
 
 if __name__ == "__main__":
+    # uvloop is a faster drop-in event loop; fall back to stock asyncio without it
+    if uvloop is not None and sys.platform != "win32":
+        uvloop.install()
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
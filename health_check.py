@@ -3,105 +3,128 @@
 Health check script for the eye tracking backend
 """
 
+import asyncio
+import functools
+import importlib.util
+import io
 import sys
 import os
 
-def check_opencv():
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Settings read by app.py (the server the Procfile runs), snapshotted once at import with its defaults
+ENV_SNAPSHOT = {
+    name: os.environ.get(name, default)
+    for name, default in [
+        ('HOST', '0.0.0.0'),
+        ('PORT', '10000'),
+        ('LOG_LEVEL', 'INFO'),
+        ('MAX_CONNECTIONS', '0'),
+    ]
+}
+
+@functools.lru_cache(maxsize=None)
+def load_cascade(path):
+    """Load a cascade classifier, parsing each XML file only once per process"""
+    import cv2
+    return cv2.CascadeClassifier(path)
+
+@functools.lru_cache(maxsize=1)
+def cascade_paths():
+    """Resolve the face and eye cascade paths once; they never change while the process runs"""
+    import cv2
+    # Validate the face cascade app.py (the server the Procfile runs) will load, e.g. a lighter LBP cascade
+    face_cascade_name = os.getenv('FACE_CASCADE', 'haarcascade_frontalface_default.xml')
+    return (
+        os.path.join(cv2.data.haarcascades, face_cascade_name),
+        cv2.data.haarcascades + 'haarcascade_eye.xml',
+    )
+
+def check_opencv(report=print) -> bool:
     """Check if OpenCV can be imported successfully"""
+    report("\n📹 OpenCV Check:")
+    
     try:
         import cv2
-        print(f"✅ OpenCV imported successfully - version: {cv2.Version()}")
+        report(f"✅ OpenCV imported successfully - version: {cv2.__version__}")
         
-        # Check if cascade files exist
-        face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        eye_cascade_path = cv2.data.haarcascades + 'haarcascade_eye.xml'
+        face_cascade_path, eye_cascade_path = cascade_paths()
         
-        if os.path.exists(face_cascade_path):
-            print(f"✅ Face cascade file found: {face_cascade_path}")
+        # Test cascade classifier loading; a missing file yields an empty classifier
+        if not load_cascade(face_cascade_path).empty():
+            report(f"✅ Face cascade classifier loaded successfully: {face_cascade_path}")
         else:
-            print(f"❌ Face cascade file not found: {face_cascade_path}")
+            report(f"❌ Failed to load face cascade classifier: {face_cascade_path}")
             return False
             
-        if os.path.exists(eye_cascade_path):
-            print(f"✅ Eye cascade file found: {eye_cascade_path}")
+        if not load_cascade(eye_cascade_path).empty():
+            report(f"✅ Eye cascade classifier loaded successfully: {eye_cascade_path}")
         else:
-            print(f"❌ Eye cascade file not found: {eye_cascade_path}")
-            return False
-        
-        # Test cascade classifier loading
-        face_cascade = cv2.CascadeClassifier(face_cascade_path)
-        eye_cascade = cv2.CascadeClassifier(eye_cascade_path)
-        
-        if not face_cascade.empty():
-            print("✅ Face cascade classifier loaded successfully")
-        else:
-            print("❌ Failed to load face cascade classifier")
-            return False
-            
-        if not eye_cascade.empty():
-            print("✅ Eye cascade classifier loaded successfully")
-        else:
-            print("❌ Failed to load eye cascade classifier")
+            report(f"❌ Failed to load eye cascade classifier: {eye_cascade_path}")
             return False
         
         return True
         
     except ImportError as e:
-        print(f"❌ Failed to import OpenCV: {e}")
+        report(f"❌ Failed to import OpenCV: {e}")
         return False
     except Exception as e:
-        print(f"❌ Error checking OpenCV: {e}")
+        report(f"❌ Error checking OpenCV: {e}")
         return False
 
-def check_dependencies():
-    """Check if all required dependencies can be imported"""
+def check_dependencies(report=print) -> bool:
+    """Check if all required dependencies are installed"""
+    report("\n📦 Dependency Check:")
+    
+    # Only third-party packages from requirements.txt; the stdlib is always there
     dependencies = [
         ('numpy', 'numpy'),
         ('websockets', 'websockets'),
-        ('asyncio', 'asyncio'),
-        ('json', 'json'),
-        ('datetime', 'datetime'),
-        ('logging', 'logging')
+        ('aiohttp', 'aiohttp'),
+        ('orjson', 'orjson'),
+        ('opencv', 'cv2')
     ]
     
+    # Locate modules without executing them; check_opencv does the one real import of cv2 (and numpy)
     all_good = True
     for name, module in dependencies:
         try:
-            __import__(module)
-            print(f"✅ {name} imported successfully")
+            if importlib.util.find_spec(module) is None:
+                raise ImportError(f"No module named '{module}'")
+            report(f"✅ {name} is installed")
         except ImportError as e:
-            print(f"❌ Failed to import {name}: {e}")
+            report(f"❌ Failed to import {name}: {e}")
             all_good = False
     
     return all_good
 
-def check_environment():
+def check_environment(report=print) -> bool:
     """Check environment variables"""
-    print("\n🔧 Environment Check:")
-    
-    host = os.getenv('HOST', 'localhost')
-    port = os.getenv('PORT', '5000')
+    report("\n🔧 Environment Check:")
     
-    print(f"✅ HOST: {host}")
-    print(f"✅ PORT: {port}")
+    for name, value in ENV_SNAPSHOT.items():
+        report(f"✅ {name}: {value}")
     
     return True
 
-def main():
+async def main():
     """Run all health checks"""
     print("🏥 Eye Tracking Backend Health Check")
     print("=" * 40)
     
-    # Check dependencies
-    print("\n📦 Dependency Check:")
-    deps_ok = check_dependencies()
-    
-    # Check OpenCV specifically
-    print("\n📹 OpenCV Check:")
-    opencv_ok = check_opencv()
-    
-    # Check environment
-    env_ok = check_environment()
+    # The checks are independent and dominated by imports and disk reads, so run them
+    # side by side and print each report in order once they have all finished
+    checks = [check_dependencies, check_opencv, check_environment]
+    reports = [io.StringIO() for _ in checks]
+    deps_ok, opencv_ok, env_ok = await asyncio.gather(*(
+        asyncio.to_thread(check, functools.partial(print, file=output))
+        for check, output in zip(checks, reports)
+    ))
+    for output in reports:
+        print(output.getvalue(), end="")
     
     # Summary
     print("\n" + "=" * 40)
@@ -115,4 +138,7 @@ def main():
         return 1
 
 if __name__ == "__main__":
-    sys.exit(main()) 
\ No newline at end of file
+    # uvloop is a faster drop-in event loop; fall back to stock asyncio without it
+    if uvloop is not None and sys.platform != "win32":
+        uvloop.install()
+    sys.exit(asyncio.run(main()))
\ No newline at end of file